@@ -1,16 +1,10 @@
-import io, os, random, glob, math, requests
+import io, os, random, math, shelve
 from pathlib import Path
 
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageStat
-
-# ---- Optional translation (English -> Hindi)
-try:
-    from googletrans import Translator
-    translator = Translator()
-except Exception:
-    translator = None
+from PIL import Image, ImageDraw, ImageFont
 
 # ============ Config ============
 load_dotenv()
@@ -20,6 +14,8 @@ AI_API_KEY = os.getenv("AI_IMAGE_API_KEY", "").strip()
 ASSETS_DIR = Path("assets")
 PIPES_DIR = ASSETS_DIR / "pipes"
 FEST_DIR  = ASSETS_DIR / "festivals"
+TRANSLATE_CACHE = "translate_cache.db"
+SHADOW = (0, 0, 0, 160)
 
 FESTIVAL_PRESETS = {
     "Diwali":   "Warm golden festive lights, soft bokeh, deep maroon + gold accents, elegant clean backdrop",
@@ -57,9 +53,13 @@ if size_label == "Custom":
 else:
     W, H = size_map[size_label]
 
+export_fmt = st.sidebar.selectbox("Export format", ["JPEG", "PNG"])
+fast_export = export_fmt == "PNG" and st.sidebar.checkbox("Fast export (larger PNG, quicker save)", value=True)
+
 # ---- Festival + background
 festival = st.selectbox("Festival", list(FESTIVAL_PRESETS.keys()))
 use_preset = st.checkbox("Use festival background preset", value=True)
+deco_seed = st.number_input("Decoration layout seed (change for a different arrangement)", value=0, step=1)
 prompt = st.text_area(
     "Background prompt (used if you don't want preset, or to refine it)",
     FESTIVAL_PRESETS[festival] if use_preset else "Elegant premium background"
@@ -93,60 +93,117 @@ font_path_main = st.text_input("Custom Latin font (optional .ttf)", "")
 font_path_hindi = st.text_input("Custom Devanagari font for Hindi (recommended)", "")
 
 # ============ Helpers ============
-def get_resampler():
+# requests and googletrans (httpx) are only needed once Generate is clicked
+@st.cache_resource(show_spinner=False)
+def _get_requests():
+    import requests
+    return requests
+
+# ---- Optional translation (English -> Hindi)
+@st.cache_resource(show_spinner=False)
+def _get_translator():
+    try:
+        from googletrans import Translator
+        return Translator()
+    except Exception:
+        return None
+
+def get_resampler(name="LANCZOS"):
     try:
-        return Image.Resampling.LANCZOS
+        return getattr(Image.Resampling, name)
     except Exception:
-        return Image.LANCZOS
+        return getattr(Image, name)
 
 RESAMPLE = get_resampler()
+RESAMPLE_FAST = get_resampler("BILINEAR")
+RESAMPLE_UP = get_resampler("BICUBIC")
+
+def ensure_rgba(im):
+    """Return im as RGBA, copying pixels only when the mode actually differs."""
+    im.load()
+    return im if im.mode == "RGBA" else im.convert("RGBA")
 
 def load_image(file_or_path):
+    """(RGBA image, opaque) where opaque means the source has no alpha at all."""
     if file_or_path is None:
-        return None
-    if hasattr(file_or_path, "read"):
-        return Image.open(file_or_path).convert("RGBA")
-    return Image.open(file_or_path).convert("RGBA")
+        return None, False
+    im = Image.open(file_or_path)
+    # Header-only check, decided once here instead of scanning alpha on every placement
+    opaque = im.mode not in ("RGBA", "LA", "PA") and "transparency" not in im.info
+    return ensure_rgba(im), opaque
 
+@st.cache_data(max_entries=8, show_spinner=False)
 def gradient_fallback(width, height):
-    top = (20, 20, 28, 255)
-    bottom = (120, 60, 20, 255)
-    base = Image.new("RGBA", (width, height), top)
-    overlay = Image.new("RGBA", (width, height), bottom)
-    mask = Image.linear_gradient("L").resize((width, height))
-    return Image.composite(overlay, base, mask)
+    top = np.array([20, 20, 28], np.float32)
+    bottom = np.array([120, 60, 20], np.float32)
+    # Blend one colour per row, then broadcast rows into a single RGBA buffer
+    t = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    rows = (top * (1 - t) + bottom * t).astype(np.uint8)
+    arr = np.empty((height, width, 4), np.uint8)
+    arr[..., :3] = rows[:, None, :]
+    arr[..., 3] = 255
+    return Image.fromarray(arr)
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def _cached_ai_background(prompt: str, width: int, height: int) -> bytes:
+    """Raw image bytes from the AI endpoint; failures raise so they are not cached."""
+    # identity: image payloads are already compressed, skip a second decode pass
+    headers = {"Accept-Encoding": "identity"}
+    if AI_API_KEY:
+        headers["Authorization"] = f"Bearer {AI_API_KEY}"
+    payload = {"prompt": prompt, "width": width, "height": height}
+    with _get_requests().post(AI_API_URL, json=payload, headers=headers, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        data = r.raw.read()
+    # A 2xx JSON/HTML error page or empty body must raise here, not get cached for an hour
+    if not data:
+        raise ValueError("empty response from AI image API")
+    Image.open(io.BytesIO(data)).verify()
+    return data
 
 def call_ai_background(prompt, width, height):
     if not AI_API_URL or not prompt.strip():
         return gradient_fallback(width, height)
-    headers = {}
-    if AI_API_KEY:
-        headers["Authorization"] = f"Bearer {AI_API_KEY}"
-    payload = {"prompt": prompt, "width": width, "height": height}
     try:
-        r = requests.post(AI_API_URL, json=payload, headers=headers, timeout=60)
-        r.raise_for_status()
-        return Image.open(io.BytesIO(r.content)).convert("RGBA")
+        data = _cached_ai_background(prompt, width, height)
+        ai_img = ensure_rgba(Image.open(io.BytesIO(data)))
+        # Providers don't always honour the requested size; backgrounds don't need LANCZOS
+        if ai_img.size != (width, height):
+            ai_img = ai_img.resize((width, height), RESAMPLE_FAST)
+        return ai_img
     except Exception:
         return gradient_fallback(width, height)
 
-def text_to_hindi(txt: str) -> str:
-    if not txt or not use_hindi or translator is None:
-        return txt
+@st.cache_data(max_entries=256, show_spinner=False)
+def _translate(text: str, src: str, dest: str) -> str:
+    # In-memory cache in front of an on-disk shelf so restarts stay warm too
+    key = f"{src}|{dest}|{text}"
     try:
-        return translator.translate(txt, src="en", dest="hi").text
+        with shelve.open(TRANSLATE_CACHE) as db:
+            if key in db:
+                return db[key]
     except Exception:
-        return txt
+        pass
+    out = _get_translator().translate(text, src=src, dest=dest).text
+    try:
+        with shelve.open(TRANSLATE_CACHE) as db:
+            db[key] = out
+    except Exception:
+        pass
+    return out
 
-def text_to_hindi_sub(txt: str) -> str:
-    if not txt or not use_hindi_sub or translator is None:
+def text_to_hindi(txt: str, enabled=True) -> str:
+    if not txt or not enabled or _get_translator() is None:
         return txt
     try:
-        return translator.translate(txt, src="en", dest="hi").text
+        return _translate(txt, "en", "hi")
     except Exception:
         return txt
 
+@st.cache_resource(max_entries=32, show_spinner=False)
 def font_from_path(path_hint: str, px: int, devanagari=False):
+    """Cached FreeType face; parsing the TTF is the expensive part."""
     # Try user-provided font first; else pick a likely system font
     try_paths = []
     if path_hint.strip():
@@ -168,7 +225,7 @@ def font_from_path(path_hint: str, px: int, devanagari=False):
 
 def hex_to_rgba(hex_str, a=255):
     if isinstance(hex_str, str) and hex_str.startswith("#") and len(hex_str) == 7:
-        return tuple(int(hex_str[i:i+2], 16) for i in (1,3,5)) + (a,)
+        return tuple(bytes.fromhex(hex_str[1:])) + (a,)
     return (255,255,255,a)
 
 def draw_text_multiline(img, text, y_frac, fill, font_size_ratio=0.07, shadow_on=True, devanagari=False):
@@ -181,39 +238,37 @@ def draw_text_multiline(img, text, y_frac, fill, font_size_ratio=0.07, shadow_on
         l,t0,r,b = draw.textbbox((0,0), t, font=fnt)
         return (r-l, b-t0)
 
-    # Basic wrap
+    # Basic wrap: measure each word once and keep a running pixel cursor
     max_w = int(W*0.9)
-    lines, line = [], ""
+    space_w = fnt.getlength(" ")
+    lines, line, cur_w = [], [], 0.0
     for word in text.split():
-        trial = (line + " " + word).strip()
-        ww,_ = measure(trial)
-        if not line or ww <= max_w:
-            line = trial
+        ww = fnt.getlength(word)
+        if not line or cur_w + space_w + ww <= max_w:
+            cur_w = cur_w + space_w + ww if line else ww
+            line.append(word)
         else:
-            lines.append(line); line = word
-    if line: lines.append(line)
+            lines.append(" ".join(line)); line, cur_w = [word], ww
+    if line: lines.append(" ".join(line))
 
-    heights = []
-    total_h = 0
-    for l in lines:
-        _,h = measure(l); heights.append(h); total_h += h
-    total_h += (len(lines)-1)*6
+    sizes = [measure(l) for l in lines]
+    total_h = sum(h for _,h in sizes) + (len(lines)-1)*6
 
     y = int(H*y_frac - total_h/2)
     color = hex_to_rgba(fill, 255)
-    for i, l in enumerate(lines):
-        tw, th = measure(l)
+    for l, (tw, th) in zip(lines, sizes):
         x = (W - tw)//2
         if shadow_on:
-            draw.text((x+2, y+2), l, font=fnt, fill=(0,0,0,160))
+            draw.text((x+2, y+2), l, font=fnt, fill=SHADOW)
         draw.text((x, y), l, font=fnt, fill=color)
-        y += heights[i] + 6
+        y += th + 6
 
-def place_image(base, overlay, target_w, anchor="Right-Center", margin=24):
-    if overlay.mode != "RGBA": overlay = overlay.convert("RGBA")
+def place_image(base, overlay, target_w, anchor="Right-Center", margin=24, opaque=False):
+    overlay = ensure_rgba(overlay)
     scale = target_w / max(1, overlay.width)
     new_size = (max(1,int(overlay.width*scale)), max(1,int(overlay.height*scale)))
-    o = overlay.resize(new_size, RESAMPLE)
+    # LANCZOS only pays off when shrinking; BICUBIC is as good for upscaling and cheaper
+    o = overlay.resize(new_size, RESAMPLE_UP if scale >= 1.0 else RESAMPLE)
     bw, bh = base.size
     x, y = margin, (bh - o.height)//2
     if anchor == "Left-Center": x = margin
@@ -223,73 +278,95 @@ def place_image(base, overlay, target_w, anchor="Right-Center", margin=24):
     if anchor == "Top-Right": x, y = bw - o.width - margin, margin
     if anchor == "Bottom-Left": x, y = margin, bh - o.height - margin
     if anchor == "Bottom-Right": x, y = bw - o.width - margin, bh - o.height - margin
-    base.alpha_composite(o, dest=(x,y))
+    # Opaque sources are a plain row copy; anything with alpha needs a real blend
+    if opaque:
+        base.paste(o, (x,y))
+    else:
+        base.alpha_composite(o, dest=(x,y))
     return base
 
-def image_blankness_score(img):
-    """Lower variance = 'blanker' background; we want more blank space."""
-    gray = img.convert("L").resize((64,64))
-    stat = ImageStat.Stat(gray)
+def gray_blankness_score(arr):
+    """Lower variance = 'blanker' region of an (H, W) grayscale array; we want more blank space."""
+    # Strided sample of roughly 64 px per side instead of a resize
+    s = max(1, min(arr.shape) // 64)
+    var = arr[::s, ::s].var()
     # Use inverse variance so higher is 'blanker'
-    var = stat.var[0] if isinstance(stat.var, list) else stat.var
     return 1.0 / (var + 1e-6)
 
-def choose_best_pipe_for_background(bg_img):
-    """Pick a pipe from assets/pipes that will stand out reasonably."""
-    candidates = sorted(glob.glob(str(PIPES_DIR / "*.*")))
-    if not candidates:
-        return None
-    # Heuristic: prefer images with transparency if available
-    rgba_first = []
-    others = []
-    for p in candidates:
+@st.cache_resource(show_spinner=False)
+def _pipe_manifest():
+    """(path, has_transparency) for every file in assets/pipes, scanned once."""
+    out = []
+    for p in sorted(PIPES_DIR.glob("*.*")):
         try:
-            im = Image.open(p)
-            if im.mode == "RGBA" and im.getchannel("A").getextrema()[0] < 255:
-                rgba_first.append(p)
-            else:
-                others.append(p)
+            with Image.open(p) as im:
+                has_a = im.mode == "RGBA" and im.getchannel("A").getextrema()[0] < 255
         except Exception:
             continue
-    ordered = rgba_first + others
+        out.append((str(p), has_a))
+    return out
+
+def choose_best_pipe_for_background(bg_img):
+    """Pick a pipe from assets/pipes that will stand out reasonably."""
+    manifest = _pipe_manifest()
+    if not manifest:
+        return None
+    # Heuristic: prefer images with transparency if available (stable sort keeps name order)
+    ordered = sorted(manifest, key=lambda item: not item[1])
     # Very simple: just return the first 'good' one.
-    return ordered[0]
+    return ordered[0][0]
 
 def auto_side_choice(bg_img):
     """Pick Left or Right side depending on which third looks 'blanker'."""
-    w,h = bg_img.size
-    left_region  = bg_img.crop((0, 0, w//3, h))
-    right_region = bg_img.crop((w - w//3, 0, w, h))
-    left_score  = image_blankness_score(left_region)
-    right_score = image_blankness_score(right_region)
+    # One grayscale pass; the thirds are zero-copy views into it
+    gray = np.asarray(bg_img.convert("L"))
+    third = max(1, gray.shape[1] // 3)
+    left_score  = gray_blankness_score(gray[:, :third])
+    right_score = gray_blankness_score(gray[:, -third:])
     return "Left-Center" if left_score >= right_score else "Right-Center"
 
-def add_festival_overlays(base, festival, how_many=3):
+@st.cache_resource(show_spinner=False)
+def _load_overlay(path: str):
+    """Decoded festival PNG, shared across reruns; callers must not mutate it."""
+    # load() inside ensure_rgba reads the pixels and releases the file handle
+    return ensure_rgba(Image.open(path))
+
+@st.cache_resource(max_entries=128, show_spinner=False)
+def _scaled_overlay(path: str, tw: int):
+    """Overlay resized to width tw, shared across reruns; callers must not mutate it."""
+    im = _load_overlay(path)
+    return im.resize((tw, max(1, int(im.height * tw / im.width))), RESAMPLE)
+
+if st.sidebar.button("Rescan assets"):
+    _pipe_manifest.clear()
+    _load_overlay.clear()
+    _scaled_overlay.clear()
+
+def plan_festival_overlays(festival, W, H, seed, how_many=3):
+    """Deterministic [(path, pos, tw), ...] layout for a festival; same seed, same plan."""
     folder = FEST_DIR / festival.lower()
     if not folder.exists():
         # also try proper-case folder names if user kept them
         folder2 = FEST_DIR / festival
         folder = folder2 if folder2.exists() else None
     if not folder:
-        return base
+        return []
 
-    files = list(folder.glob("*.png"))
+    files = sorted(folder.glob("*.png"))
     if not files: 
-        return base
+        return []
 
-    W,H = base.size
+    rng = random.Random(seed)
     k = min(how_many, len(files))
-    picks = random.sample(files, k)
-    for p in picks:
+    plan = []
+    for p in rng.sample(files, k):
         try:
-            elem = Image.open(p).convert("RGBA")
             # scale to 8–20% of width
-            tw = int(W * random.uniform(0.08, 0.20))
-            scale = tw / elem.width
-            elem = elem.resize((tw, int(elem.height*scale)), RESAMPLE)
+            tw = int(W * rng.uniform(0.08, 0.20))
+            elem = _scaled_overlay(str(p), tw)
             # place in random decorative zones near corners/edges
             margin = int(min(W,H) * 0.03)
-            pos_choice = random.choice([
+            pos_choice = rng.choice([
                 (margin, margin),
                 (W - elem.width - margin, margin),
                 (margin, H - elem.height - margin),
@@ -297,7 +374,15 @@ def add_festival_overlays(base, festival, how_many=3):
                 (W//2 - elem.width//2, margin),
                 (W//2 - elem.width//2, H - elem.height - margin)
             ])
-            base.alpha_composite(elem, dest=pos_choice)
+            plan.append((str(p), pos_choice, tw))
+        except Exception:
+            continue
+    return plan
+
+def add_festival_overlays(base, picks):
+    for path, pos, tw in picks:
+        try:
+            base.alpha_composite(_scaled_overlay(path, tw), dest=pos)
         except Exception:
             continue
     return base
@@ -305,83 +390,56 @@ def add_festival_overlays(base, festival, how_many=3):
 # ============ Generate ============
 if st.button("Generate Banner", type="primary"):
     # 1) Background
-    base = call_ai_background(prompt, int(W), int(H)).convert("RGBA")
+    base = call_ai_background(prompt, int(W), int(H))
 
     # 2) Festival overlays
-    base = add_festival_overlays(base, festival, how_many=3)
+    overlay_plan = plan_festival_overlays(festival, int(W), int(H), deco_seed, how_many=3)
+    base = add_festival_overlays(base, overlay_plan)
 
     # 3) Choose/Place pipe
     if pipe_file:
-        pipe_img = load_image(pipe_file)
+        pipe_img, pipe_opaque = load_image(pipe_file)
         pipe_anchor = pipe_pos
     else:
         # auto pick from assets and auto side
         picked = choose_best_pipe_for_background(base)
-        pipe_img = load_image(picked) if picked else None
+        pipe_img, pipe_opaque = load_image(picked)
         pipe_anchor = auto_side_choice(base)
 
     if pipe_img is not None:
-        base = place_image(base, pipe_img, int(W * (pipe_scale / 100.0)), anchor=pipe_anchor)
+        base = place_image(base, pipe_img, int(W * (pipe_scale / 100.0)), anchor=pipe_anchor, opaque=pipe_opaque)
 
     # 4) Place logo
     if logo_file:
-        logo_img = load_image(logo_file)
-        base = place_image(base, logo_img, int(W * (logo_scale / 100.0)), anchor=logo_pos)
+        logo_img, logo_opaque = load_image(logo_file)
+        base = place_image(base, logo_img, int(W * (logo_scale / 100.0)), anchor=logo_pos, opaque=logo_opaque)
 
     # 5) Text (English or Hindi)
-    headline_txt = text_to_hindi(headline_en) if use_hindi else headline_en
-    subtext_txt  = text_to_hindi_sub(subtext_en) if use_hindi_sub else subtext_en
+    headline_txt = text_to_hindi(headline_en, use_hindi)
+    subtext_txt  = text_to_hindi(subtext_en, use_hindi_sub)
 
     # Slightly adjust headline Y depending on aspect
     headline_y = 0.18 if H >= W else 0.22
     subtext_y  = headline_y + 0.12
 
-    def draw_text(img, txt, y, ratio, devanagari=False):
-        # Render with Pillow>=10-safe textbbox
-        if not txt: return
-        W_,H_ = img.size
-        fnt = font_from_path(font_path_hindi if devanagari else font_path_main, max(12,int(W_*ratio)), devanagari)
-        draw = ImageDraw.Draw(img)
-        color = hex_to_rgba(brand_color, 255)
-
-        def measure(t): 
-            l,t0,r,b = draw.textbbox((0,0), t, font=fnt)
-            return (r-l, b-t0)
-
-        max_w = int(W_*0.9)
-        words = txt.split()
-        lines, line = [], ""
-        for word in words:
-            trial = (line+" "+word).strip()
-            ww,_ = measure(trial)
-            if not line or ww <= max_w:
-                line = trial
-            else:
-                lines.append(line); line = word
-        if line: lines.append(line)
-
-        heights = []
-        total_h = 0
-        for l in lines:
-            _,h = measure(l); heights.append(h); total_h += h
-        total_h += (len(lines)-1)*6
-        yy = int(H_*y - total_h/2)
-        for i, l in enumerate(lines):
-            tw, th = measure(l)
-            x = (W_ - tw)//2
-            if shadow:
-                draw.text((x+2, yy+2), l, font=fnt, fill=(0,0,0,160))
-            draw.text((x, yy), l, font=fnt, fill=color)
-            yy += heights[i] + 6
-
-    draw_text(base, headline_txt, headline_y, 0.075, devanagari=use_hindi)
-    draw_text(base, subtext_txt,  subtext_y,  0.045, devanagari=use_hindi_sub)
+    draw_text_multiline(base, headline_txt, headline_y, brand_color, 0.075, shadow_on=shadow, devanagari=use_hindi)
+    draw_text_multiline(base, subtext_txt,  subtext_y,  brand_color, 0.045, shadow_on=shadow, devanagari=use_hindi_sub)
 
     # 6) Preview + Download
-    st.image(base, caption="Preview", use_column_width=True)
+    rgb = base.convert("RGB")
+    # Small JPEG proxy for the browser, shown at its own size; the download stays full resolution
+    preview = rgb.resize((512, max(1, rgb.height * 512 // rgb.width)), RESAMPLE_FAST)
+    preview_buf = io.BytesIO()
+    preview.save(preview_buf, format="JPEG", quality=85)
+    st.image(preview_buf.getvalue(), caption="Preview")
     buf = io.BytesIO()
-    base.convert("RGB").save(buf, format="PNG")
-    st.download_button("Download PNG", data=buf.getvalue(), file_name=f"{festival.lower()}_banner.png", mime="image/png")
+    if export_fmt == "JPEG":
+        rgb.save(buf, format="JPEG", quality=92, optimize=False, progressive=False)
+        ext, mime = "jpg", "image/jpeg"
+    else:
+        rgb.save(buf, format="PNG", compress_level=1 if fast_export else 6, optimize=False)
+        ext, mime = "png", "image/png"
+    st.download_button(f"Download {export_fmt}", data=buf.getvalue(), file_name=f"{festival.lower()}_banner.{ext}", mime=mime)
 
 st.caption("Tip: Put your product photos in assets/pipes/ and festival PNGs in assets/festivals/<festival>/. "
            "Set AI_IMAGE_API_URL & AI_IMAGE_API_KEY to use an AI background; otherwise you'll get a nice gradient.")